@@ -0,0 +1,44 @@
+# cython: language_level=3
+"""Compiled version of the gemtext post-processing done by Remini's \
+        `parse_markdown` function. Build it with:
+
+    cythonize -3 -i gemparse.pyx
+
+If the compiled module is not available, Remini falls back to an \
+equivalent pure-Python implementation.
+
+"""
+
+cpdef str fix_gemtext(str gemtext, object parse_url):
+    """Adjust the gemtext produced by md2gemini. Headings are demoted \
+            by one level and the URLs of links are passed through \
+            `parse_url`.
+
+    :param gemtext: The gemtext to adjust.
+    :param parse_url: A function which takes a URL and returns the URL \
+            to use in its place.
+    :return: The adjusted gemtext.
+
+    """
+    cdef list lines = gemtext.split('\n')
+    cdef Py_ssize_t i, n, start, end
+    cdef str line
+    for i in range(len(lines)):
+        line = lines[i]
+        if line.startswith('#'):
+            lines[i] = '#' + line
+        elif line.startswith('=>'):
+            n = len(line)
+            # Skip the whitespace between "=>" and the URL (there must
+            # be some)
+            start = 2
+            while start < n and line[start].isspace():
+                start += 1
+            if start == 2 or start == n:
+                continue
+            # The URL runs until the next whitespace character
+            end = start
+            while end < n and not line[end].isspace():
+                end += 1
+            lines[i] = '=> ' + parse_url(line[start:end]) + line[end:]
+    return '\n'.join(lines)
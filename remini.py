@@ -1,15 +1,56 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
+import asyncio
+from hashlib import blake2b
 import logging
 import os
+import re
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from types import SimpleNamespace
+from functools import lru_cache
 from urllib.parse import unquote, urlparse
-from datetime import datetime
-from typing import List, Union, Tuple
+from typing import List, Union, Tuple, Dict, Optional, Set, Iterable, Iterator, AsyncIterator, TYPE_CHECKING
+
+from cachetools import TTLCache
+
+# asyncpraw (and aiohttp) and md2gemini are slow to import, so we only
+# import them when they are first needed. This means that requests
+# that don't need them (eg, redirects) are quicker when run from the
+# command line.
+if TYPE_CHECKING:
+    import aiohttp
+    import asyncpraw
+    from asyncpraw.models import Submission, Subreddit, Comment, Redditor, MoreComments
 
-import praw
-from praw.models import Submission, Subreddit, Comment, Redditor
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
 
-from md2gemini import md2gemini
+# orjson parses and serialises JSON considerably faster than the
+# standard library; use it if it is installed.
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    import json
+    json_loads = json.loads
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+# Compiled gemtext post-processing (see gemparse.pyx), if it has been
+# built; otherwise we use the pure-Python equivalent.
+try:
+    from gemparse import fix_gemtext
+except ImportError:
+    fix_gemtext = None
 
 # How to format dates and times
 DATE_FMT = '%d/%m/%Y'
@@ -18,6 +59,16 @@ DATETIME_FMT = f'{DATE_FMT} at %H:%M UTC'
 # How many items (comments, submissions, etc) to display
 ITEM_LIMIT = 25
 
+# Whether to fetch submissions and their comments directly from
+# Reddit's JSON API (falling back to asyncpraw if that fails), which
+# avoids the overhead of building asyncpraw objects for the whole thread
+USE_JSON_API = True
+# How long (in seconds) to wait for a response from the JSON API, and
+# for how long to stop using it after a request fails (if Reddit
+# doesn't tell us when to retry)
+JSON_API_TIMEOUT = 3
+JSON_API_BACKOFF = 300
+
 # Get certain config options from environment variables
 try:
     BASE_URL = os.environ['REMINI_BASE_URL']
@@ -37,18 +88,44 @@ if LOG_FILE:
 # or query.
 LANDING_PAGE = os.environ.get('REMINI_LANDING_PAGE')
 
+# If this environment variable is set (and the diskcache library is
+# installed), parsed markdown will be cached on disk in the relevant
+# directory, so that it can be shared between processes.
+CACHE_DIR = os.environ.get('REMINI_CACHE_DIR')
+
 # Error message to print when we don't know what happened.
 GENERIC_ERR_MSG = ('Got unexpected error. This could include the page not being available, '
                    'Reddit being down, or some other error. Details of the error have been logged.')
 
+# The PRAW file should contain the client ID, client secret and user
+# agent, in that order, on separate lines.
 with open(PRAW_FILE) as f:
-    CLIENT_ID, CLIENT_SECRET, USER_AGENT = (line.strip() for line in f.readlines())
+    praw_config = [line.strip() for line in f.read().split('\n', 3)[:3]]
+if len(praw_config) < 3 or not all(praw_config):
+    raise RuntimeError(f'"{PRAW_FILE}" must contain the client ID, client secret '
+                       'and user agent on its first three lines.')
+CLIENT_ID, CLIENT_SECRET, USER_AGENT = praw_config
 
 # The different bases for Reddit URLs
 REDDIT_DOMAINS = [
     ['redd', 'it'],
     ['reddit', 'com']
 ]
+# The same domains, as "netloc suffixes" for fast lookup
+REDDIT_NETLOC_SUFFIXES = frozenset('.'.join(d) for d in REDDIT_DOMAINS)
+
+# Matches gemtext link lines (capturing the URL and the rest of the
+# line) and heading lines
+GEM_LINE_RE = re.compile(r'^(=>[^\S\n]+(\S+)(.*)|#{1,2}[^\n]*)$', re.MULTILINE)
+
+# The methods used to get a subreddit's submissions, for each way of
+# sorting them
+SORT_METHODS = {
+    'hot': lambda s, limit: s.hot(limit=limit),
+    'top': lambda s, limit: s.top(limit=limit),
+    'new': lambda s, limit: s.new(limit=limit),
+    'controversial': lambda s, limit: s.controversial(limit=limit)
+}
 
 # Top level Reddit "commands" that we support
 REDDIT_CMDS = {
@@ -56,11 +133,137 @@ REDDIT_CMDS = {
     'u'
 }
 
-reddit = praw.Reddit(
-    user_agent=USER_AGENT,
-    client_id=CLIENT_ID,
-    client_secret=CLIENT_SECRET
-)
+# Settings for the pool of HTTP connections used to access Reddit:
+# maximum number of simultaneous connections, how long (in seconds) to
+# cache DNS lookups and how long to keep idle connections open.
+HTTP_MAX_CONNECTIONS = 64
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 60
+
+# The maximum number of requests to Reddit (through asyncpraw or the
+# JSON API, to any of Reddit's hosts) that may be in progress at once.
+# Further requests wait until one of those finishes.
+REDDIT_MAX_REQUESTS = 30
+reddit_semaphore = asyncio.Semaphore(REDDIT_MAX_REQUESTS)
+# Whether the current task already holds `reddit_semaphore`. asyncprawcore
+# retries requests (and refreshes its access token) while the original
+# request is still open, so those requests must not wait for the
+# semaphore again, or they could wait forever.
+holding_reddit_semaphore: ContextVar[bool] = ContextVar('holding_reddit_semaphore', default=False)
+
+# The asyncpraw.Reddit instance used to access Reddit, and the HTTP
+# session it uses (which we also use to access the JSON API directly).
+# The session must be created inside the event loop, so these are set
+# by `get_reddit` when first needed.
+reddit: Optional[asyncpraw.Reddit] = None
+http_session: Optional[aiohttp.ClientSession] = None
+
+# How many threads to use to render lists of comments. Each page's
+# comments are rendered in a single job. The pool is shared by all
+# requests so that threads are not created per request; they are only
+# started once they are first needed.
+RENDER_THREADS = 8
+render_pool = ThreadPoolExecutor(max_workers=RENDER_THREADS)
+
+# How many parsed markdown strings to keep in memory
+MARKDOWN_CACHE_SIZE = 4096
+
+# How many parsed URLs to keep in memory
+URL_CACHE_SIZE = 8192
+
+# How many rendered pages to keep in memory, and for how long (in
+# seconds) to serve them before fetching them from Reddit again
+PAGE_CACHE_SIZE = 2048
+PAGE_CACHE_TTL = 120
+SUBREDDIT_CACHE_TTL = 30
+COMMENTS_CACHE_TTL = 300
+# How long (in seconds) after a cached page has expired that we may
+# still serve it while fetching a fresh version in the background
+STALE_PAGE_CACHE_TTL = 3600
+
+if CACHE_DIR and (diskcache is not None):
+    markdown_disk_cache = diskcache.Cache(CACHE_DIR)
+else:
+    if CACHE_DIR:
+        logging.warning('"REMINI_CACHE_DIR" is set but diskcache is not installed; '
+                        'not caching to disk.')
+    markdown_disk_cache = None
+
+# Rendered pages, keyed by the type of page
+page_caches = {
+    'subreddit': TTLCache(maxsize=PAGE_CACHE_SIZE, ttl=SUBREDDIT_CACHE_TTL),
+    'comments': TTLCache(maxsize=PAGE_CACHE_SIZE, ttl=COMMENTS_CACHE_TTL),
+    'other': TTLCache(maxsize=PAGE_CACHE_SIZE, ttl=PAGE_CACHE_TTL)
+}
+stale_page_cache = TTLCache(maxsize=PAGE_CACHE_SIZE, ttl=STALE_PAGE_CACHE_TTL)
+# Tasks rendering pages, keyed in the same way as the page caches. All
+# requests for a page which is being rendered wait on the same task,
+# rather than each fetching the page from Reddit.
+pending_pages: Dict[bytes, asyncio.Task] = {}
+# Tasks refreshing stale pages in the background (we must hold a
+# reference to running tasks)
+refresh_tasks: Set[asyncio.Task] = set()
+
+# The time (as given by time.monotonic()) until which we should not
+# use the JSON API, because a recent request to it failed (eg, because
+# we were being rate limited).
+json_api_disabled_until = 0.0
+
+def get_reddit() -> asyncpraw.Reddit:
+    """Get the asyncpraw.Reddit instance (stored in `reddit`), creating \
+            it on first use, with an HTTP session that keeps \
+            connections to Reddit alive and reuses them between \
+            requests. Must be called from within the running event loop.
+
+    :return: The asyncpraw.Reddit instance.
+
+    """
+    global reddit, http_session
+    if reddit is None:
+        import aiohttp
+        import asyncpraw
+        from asyncprawcore import Requestor
+
+        class LimitedRequestor(Requestor):
+            """A Requestor which holds `reddit_semaphore` while each \
+                    request is in progress."""
+
+            @asynccontextmanager
+            async def request(self, *args, **kwargs):
+                async with limit_reddit_requests():
+                    async with super().request(*args, **kwargs) as response:
+                        yield response
+
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_MAX_CONNECTIONS,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT
+        )
+        http_session = aiohttp.ClientSession(connector=connector)
+        reddit = asyncpraw.Reddit(
+            user_agent=USER_AGENT,
+            client_id=CLIENT_ID,
+            client_secret=CLIENT_SECRET,
+            requestor_class=LimitedRequestor,
+            requestor_kwargs={'session': http_session}
+        )
+    return reddit
+
+@asynccontextmanager
+async def limit_reddit_requests():
+    """Wait until fewer than `REDDIT_MAX_REQUESTS` requests to Reddit \
+            are in progress, and count the current request until the \
+            context exits. Does nothing if the current task is \
+            already counted."""
+    if holding_reddit_semaphore.get():
+        yield
+        return
+    async with reddit_semaphore:
+        token = holding_reddit_semaphore.set(True)
+        try:
+            yield
+        finally:
+            holding_reddit_semaphore.reset(token)
 
 # General helper functions
 
@@ -85,13 +288,10 @@ def date_time(obj: Union[Comment, Submission, Subreddit, Redditor], date_only: b
         fmt = DATE_FMT
     else:
         fmt = DATETIME_FMT
-    s = datetime.utcfromtimestamp(obj.created_utc).strftime(fmt)
-    try:
-        if obj.edited:
-            s += '*'
-    except AttributeError:
-        # obj cannot be edited (eg, Subreddit)
-        pass
+    s = time.strftime(fmt, time.gmtime(obj.created_utc))
+    # obj may not be editable (eg, Subreddit)
+    if getattr(obj, 'edited', False):
+        s += '*'
     return s
 
 def author(obj: Union[Comment, Submission]) -> str:
@@ -99,7 +299,7 @@ def author(obj: Union[Comment, Submission]) -> str:
 
     :param obj: The object whose name we are looking for. Should have \
             an `author` attribute which is an instance of \
-            praw.models.Redditor.
+            asyncpraw.models.Redditor.
     :return: The name of the author, or "[deleted]" if the name could \
             not be found.
     """
@@ -112,7 +312,7 @@ def author(obj: Union[Comment, Submission]) -> str:
 def get_submission_url(comment: Comment) -> str:
     """Get the URL of the submission to which a comment relates.
 
-    :param: The praw.models.Comment object to inspect.
+    :param: The asyncpraw.models.Comment object to inspect.
     :return: The (Remini-usable) URL of the submission.
 
     """
@@ -124,7 +324,7 @@ def get_parent_url(comment: Comment) -> Tuple[str, bool]:
             or submission the comment is replying to). The URL will be \
             usable by Remini.
 
-    :param comment: The praw.models.Comment objecti to inspect.
+    :param comment: The asyncpraw.models.Comment objecti to inspect.
     :param parse: Whether to return the URL as a parsed, "Remini-\
             friendly" URL.
     :return: A tuple containing the URL of the parent comment or \
@@ -146,10 +346,95 @@ def get_parent_url(comment: Comment) -> Tuple[str, bool]:
     else:
         raise ValueError(f'Bad ID "{parent_id}". Expecting it to start with t1_ or t3_.')
 
+async def prefetch(items: List[Union[Comment, Submission]]) -> Tuple[List[Union[Comment, Submission]], Set[str]]:
+    """Make sure that all of the given comments or submissions have \
+            been loaded, fetching any which have not been loaded in a \
+            single batched request (rather than one request each).
+
+    :param items: The asyncpraw.models.Comment or \
+            asyncpraw.models.Submission objects to check.
+    :return: A tuple containing a list of the same items, in the same \
+            order, with any unloaded items replaced by loaded \
+            equivalents, and the set of fullnames of the items that \
+            were fetched. Any asyncpraw.models.MoreComments objects \
+            are removed. Comments that were fetched in this way do not \
+            include their replies.
+
+    """
+    from asyncpraw.models import MoreComments
+    items = [i for i in items if not isinstance(i, MoreComments)]
+    # Checking for an attribute using hasattr() would trigger a fetch,
+    # so we inspect the object's __dict__ instead.
+    fullnames = [i.fullname for i in items if 'created_utc' not in i.__dict__]
+    if not fullnames:
+        return items, set()
+    logging.debug(f'Fetching {len(fullnames)} unloaded items.')
+    fetched = {i.fullname: i async for i in get_reddit().info(fullnames=fullnames)}
+    return [fetched.get(i.fullname, i) for i in items], set(fetched)
+
+def count_comments(items: Iterable[Union[Comment, MoreComments]]) -> int:
+    """Count the comments in a comment forest (or list of replies), \
+            including those which have not been loaded but are listed \
+            in a MoreComments object. The MoreComments objects are not \
+            expanded, as that would require further API calls.
+
+    :param items: The asyncpraw.models.Comment and \
+            asyncpraw.models.MoreComments objects to count.
+    :return: The number of comments.
+
+    """
+    from asyncpraw.models import MoreComments
+    count = 0
+    for i in items:
+        if isinstance(i, MoreComments):
+            count += len(i.children)
+        else:
+            count += 1
+    return count
+
+def reply_count(comment: Comment) -> Optional[int]:
+    """Count the direct replies to a comment, without making any API \
+            calls.
+
+    :param comment: The asyncpraw.models.Comment object to inspect.
+    :return: The number of direct replies, or None if the comment has \
+            not been loaded.
+
+    """
+    # Accessing comment.replies when the comment has not been loaded
+    # would raise an exception (and hasattr() would trigger a fetch), so
+    # we check the object's __dict__.
+    if 'created_utc' not in comment.__dict__:
+        return None
+    return count_comments(comment.replies)
+
+def reply_counts(comments: List[Comment], unknown: Set[str] = frozenset()) -> Dict[str, Optional[int]]:
+    """Count the direct replies to each of the given comments.
+
+    :param comments: The asyncpraw.models.Comment objects to inspect.
+    :param unknown: The fullnames of comments whose replies are not \
+            known, such as those fetched by `prefetch` (Reddit's \
+            /api/info endpoint doesn't return replies).
+    :return: A dict mapping each comment's ID to its number of replies \
+            (or None if the number is not known).
+
+    """
+    return {c.id: None if c.fullname in unknown else reply_count(c) for c in comments}
+
+async def collect(listing) -> list:
+    """Retrieve all items from an asyncpraw listing generator.
+
+    :param listing: The listing generator to consume.
+    :return: A list of the items in the listing.
+
+    """
+    return [item async for item in listing]
+
 
 ## These functions parse Reddit URLs or markdown to convert them to
 ## Remini-friendly equivalents.
 
+@lru_cache(maxsize=URL_CACHE_SIZE)
 def parse_reddit_url(url: str) -> str:
     """If a URL is for a page on Reddit, convert to a Remini URL; \
             otherwise, return the URL unchanged.
@@ -166,14 +451,9 @@ def parse_reddit_url(url: str) -> str:
         # URL appears to be relative
         reddit_url = True
     else:
-        domain = parsed.netloc.split('.')[-2:]
-        for d in REDDIT_DOMAINS:
-            if d == domain:
-                reddit_url = True
-                break
-        else:
-            reddit_url = False
-    if reddit_url and handle_request(parsed.path, parsed.query, True):
+        domain = '.'.join(parsed.netloc.split('.')[-2:])
+        reddit_url = domain in REDDIT_NETLOC_SUFFIXES
+    if reddit_url and _is_supported_path(parsed.path):
         logging.debug('URL is supported Reddit URL; converting.')
         new_url = BASE_URL + parsed.path.lstrip('/')
         logging.debug(f'New URL is "{new_url}".')
@@ -182,6 +462,29 @@ def parse_reddit_url(url: str) -> str:
         logging.debug(f'URL is not Reddit URL; returning unchanged.')
         return url
 
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def _is_supported_path(path: str) -> bool:
+    """Check whether Remini supports the given request path. This \
+            depends only on the path itself, so the result is cached.
+
+    :param path: The request path.
+    :return: Whether the path is supported.
+
+    """
+    logging.debug(f'Checking support for path "{path}".')
+    path = path.strip().strip('/')
+    if not path:
+        return True
+    tokens = tokenize_path(path)
+    cmd, tokens = tokens[0], tokens[1:]
+    if cmd == 'r':
+        return (not tokens) or (r_dispatch_key(tokens) in R_DISPATCH)
+    elif cmd == 'u':
+        return len(tokens) <= 1
+    else:
+        logging.debug(f'Path not supported: Unknown command "{cmd}".')
+        return False
+
 def parse_markdown(md: str) -> List[str]:
     """Parse Reddit-style markdown, converting to gemtext and making
     some other adjustments.
@@ -190,35 +493,97 @@ def parse_markdown(md: str) -> List[str]:
     :return: The resulting gemtext as a list of line strings.
 
     """
-    gemtext = md2gemini(md, links='paragraph').split('\n')
-    for i, line in enumerate(gemtext):
-        if line.startswith('#') or line.startswith('##'):
-            gemtext[i] = '#' + line
-        elif line.startswith('=> '):
-            tokens = line.split(' ')
-            tokens[1] = parse_reddit_url(tokens[1])
-            gemtext[i] = ' '.join(tokens)
-    return gemtext
+    return list(_parse_markdown_cached(md))
+
+@lru_cache(maxsize=MARKDOWN_CACHE_SIZE)
+def _parse_markdown_cached(md: str) -> Tuple[str, ...]:
+    """Cached implementation of `parse_markdown`. Returns a tuple so \
+            that the cached value cannot be modified by callers. If \
+            a disk cache is configured, it is checked before the \
+            markdown is actually parsed.
+
+    :param md: The Reddit-style markdown to parse.
+    :return: The resulting gemtext as a tuple of line strings.
+
+    """
+    if markdown_disk_cache is not None:
+        # Converted URLs depend on BASE_URL, so include it in the key.
+        # Values are stored as JSON-encoded lists of lines.
+        key = ('json', BASE_URL, blake2b(md.encode()).hexdigest())
+        cached = markdown_disk_cache.get(key)
+        if cached is not None:
+            return tuple(json_loads(cached))
+        gemtext = tuple(_parse_markdown(md))
+        markdown_disk_cache.set(key, json_dumps(gemtext))
+        return gemtext
+    return tuple(_parse_markdown(md))
+
+def _parse_markdown(md: str) -> List[str]:
+    """Actually parse the markdown (see `parse_markdown`)."""
+    from md2gemini import md2gemini
+    gemtext = md2gemini(md, links='paragraph')
+    if fix_gemtext is not None:
+        return fix_gemtext(gemtext, parse_reddit_url).split('\n')
+    return GEM_LINE_RE.sub(_fix_gem_line, gemtext).split('\n')
+
+def _fix_gem_line(match: re.Match) -> str:
+    """Adjust a line of gemtext matched by `GEM_LINE_RE`. Links to \
+            Reddit are converted to Remini URLs, and headings are \
+            demoted by one level (so "#" becomes "##" and "##" becomes \
+            "###"), so that they sit below the page's own headings.
+
+    :param match: The match object for the line.
+    :return: The adjusted line.
+
+    """
+    url = match.group(2)
+    if url is not None:
+        return f'=> {parse_reddit_url(url)}{match.group(3)}'
+    else:
+        return '#' + match.group(0)
 
 ## These functions are for sending responses to the client.
 
-def ok(lines: List[str], join_on_newline: bool = True) -> bytes:
+async def ok(lines: AsyncIterator[str]) -> bytes:
     """Send the given lines to stdout, preceded by a 20 (success) \
             response.
 
-    :param lines: List of lines to send to stdout.
-    :param join_on_newline: Whether to join `lines` on newlines, or an \
-            empty string. Should be False if each line in `lines` \
-            already has a newline at the end.
+    :param lines: Asynchronous iterator of lines to send to stdout, \
+            such as one of the `display_*` functions. Each line is \
+            encoded as it is produced, so the full text of the page is \
+            never built as a string.
     :return: Bytes to be sent to the client.
 
     """
-    if join_on_newline:
-        content = '\n'.join(lines)
+    chunks = [b'20 text/gemini\r\n']
+    async for line in lines:
+        chunks.append(line.encode() + b'\n')
+
+    return b''.join(chunks)
+
+def load_landing_page():
+    """Read the landing page (if any) and store the full response to \
+            be sent to the client in `landing_page`. This is called \
+            once at startup, and again whenever we receive a SIGHUP, \
+            so that the landing page can be updated without a restart.
+
+    """
+    global landing_page
+    if LANDING_PAGE:
+        with open(LANDING_PAGE, 'rb') as f:
+            landing_page = b'20 text/gemini\r\n' + f.read() + b'\n'
     else:
-        content = ''.join(lines)
+        landing_page = b'20 text/gemini\r\nRemini is working, but no landing page has been set.\n'
+
+def reload_landing_page():
+    """Re-read the landing page, logging (rather than raising) any error."""
+    logging.info('Reloading landing page.')
+    try:
+        load_landing_page()
+    except OSError as e:
+        logging.error(f'Could not reload landing page: {e}')
 
-    return f'20 text/gemini\r\n{content}\n'.encode()
+load_landing_page()
 
 def bad_request(msg: str = '') -> bytes:
     """Send a 59 (bad request) response.
@@ -252,262 +617,433 @@ def redirect(url: str, perm: bool = True) -> bytes:
 
 # Functions for displaying a subreddit
 
-def display_subreddit(name: str, sortby: str = 'hot', limit: int = 10) -> List[str]:
+async def display_subreddit(name: str, sortby: str = 'hot', limit: int = ITEM_LIMIT) -> AsyncIterator[str]:
     """Get a list of submissions for a given subreddit.
 
     :param name: The name of the subreddit.
     :param sortby: How to sort submissions ('top', 'hot', 'new' or \
             'controversial').
     :param limit: How many submissions to display.
-    :return: A list of line strings to be displayed to the user.
+    :return: An iterator of line strings to be displayed to the user.
 
     """
-    subreddit = reddit.subreddit(name)
+    subreddit = await get_reddit().subreddit(name, fetch=True)
     timestamp = date_time(subreddit, date_only=True)
 
-    lines = [
-        f'# Subreddit: {subreddit.display_name}',
-        f'Created on {timestamp}. {subreddit.subscribers} subscribers.',
-        '',
-        '## Submissions'
-        ''
-    ]
-    if sortby == 'hot':
-        submissions = subreddit.hot(limit=ITEM_LIMIT)
-    elif sortby == 'top':
-        submissions = subreddit.top(limit=ITEM_LIMIT)
-    elif sortby == 'new':
-        submissions = subreddit.new(limit=ITEM_LIMIT)
-    elif sortby == 'controversial':
-        submissions = subreddit.controversial(limit=ITEM_LIMIT)
-    else:
+    yield f'# Subreddit: {subreddit.display_name}'
+    yield f'Created on {timestamp}. {subreddit.subscribers} subscribers.'
+    yield ''
+    yield '## Submissions'
+
+    try:
+        method = SORT_METHODS[sortby]
+    except KeyError:
         raise ValueError(f'Bad value for sortby: "{sortby}".')
+    submissions = await collect(method(subreddit, limit=limit))
 
     if not submissions:
-        lines.append('There\'s nothing here!')
+        yield 'There\'s nothing here!'
 
     for s in submissions:
-        lines.extend(submission_summary(s))
-        lines.append('')
-
-    return lines
+        for line in submission_summary(s):
+            yield line
+        yield ''
 
-def submission_summary(submission: Submission) -> List[str]:
+def submission_summary(submission: Submission) -> Iterator[str]:
     """Display a summary of a submission (such as if we are viewing a \
             list of submissions from the subreddit page).
 
-    :param submission: The praw.models.Submission object we want to \
-            display.
-    :return: A list of strings, which will be displayed to the user as \
-            lines, in order.
+    :param submission: The asyncpraw.models.Submission object we want \
+            to display.
+    :return: An iterator of strings, which will be displayed to the \
+            user as lines, in order.
 
     """
 
-    lines = []
-    
     url = parse_reddit_url(submission.url)
-    lines.append(f'=> {url} {submission.title}')
+    yield f'=> {url} {submission.title}'
     
     author_name = author(submission)
     timestamp = date_time(submission)
-    upvotes = submission.score
     parsed = urlparse(submission.url)
     scheme = parsed.scheme
     netloc = parsed.netloc
-    lines.append(f'created by {author_name} on {timestamp} - {submission.score} upvotes ({scheme}, {netloc})')
+    yield f'created by {author_name} on {timestamp} - {submission.score} upvotes ({scheme}, {netloc})'
 
     comments_url = parse_reddit_url(submission.permalink)
-    lines.append(f'=> {comments_url} {submission.num_comments} comments')
-
-    return lines
+    yield f'=> {comments_url} {submission.num_comments} comments'
 
 
 # Functions for displaying a submission and comments
 
-def display_submission(submission_id: str) -> List[str]:
+async def display_submission(submission_id: str) -> AsyncIterator[str]:
     """Display the permalink for a submission. Displays the body (if \
             any) of the submission at the top of the page followed by \
             a list of the direct replies.
 
     :param submission_id: The ID of the submission we want to display.
-    :return: A list of strings, which will be displayed to the user as \
-            lines, in order.
+    :return: An iterator of strings, which will be displayed to the \
+            user as lines, in order.
 
     """
-    submission = reddit.submission(id=submission_id)
+    thread = None
+    if USE_JSON_API:
+        thread = await fetch_thread_json(submission_id)
+    if thread is None:
+        thread = await fetch_thread(submission_id)
+    submission, comments, total_comments, num_replies = thread
     timestamp = date_time(submission)
-    comments = submission.comments[:ITEM_LIMIT]
-
-    total_comments = len(submission.comments)
     showing_comments = len(comments)
 
-    lines = [
-        f'# {submission.title}',
-        f'=> {submission.url}',
-        f'created by {author(submission)} on {timestamp}',
-        f'{submission.score} upvotes, {total_comments} top-level comments (showing {showing_comments})',
-        '',
-    ]
+    yield f'# {submission.title}'
+    yield f'=> {submission.url}'
+    yield f'created by {author(submission)} on {timestamp}'
+    yield f'{submission.score} upvotes, {total_comments} top-level comments (showing {showing_comments})'
+    yield ''
 
     if submission.selftext:
-        lines.extend([
-            *parse_markdown(submission.selftext),
-            ''
-        ])
+        for line in parse_markdown(submission.selftext):
+            yield line
+        yield ''
 
-    lines.extend([
-        '',
-        '# Comments',
-        ''
-    ])
+    yield ''
+    yield '# Comments'
+    yield ''
 
     if not comments:
-        lines.append('There\'s nothing here!')
+        yield 'There\'s nothing here!'
     else:
-        for c in comments:
-            lines.extend(comment_summary(c, show_num_replies=True))
-            lines.append('')
+        for line in await render_comment_summaries(comments, num_replies):
+            yield line
 
-    return lines
+async def fetch_thread(submission_id: str) -> Tuple[Submission, List[Comment], int, Dict[str, int]]:
+    """Fetch a submission and its top-level comments using asyncpraw.
 
-def display_comment(comment_id: str) -> List[str]:
+    :param submission_id: The ID of the submission.
+    :return: A tuple containing the submission, a list of (up to \
+            `ITEM_LIMIT`) top-level comments, the total number of \
+            top-level comments and a dict mapping each comment's ID to \
+            its number of direct replies.
+
+    """
+    # Fetching the submission also fetches its comment tree, so no
+    # further requests are needed to display the comments.
+    submission = await get_reddit().submission(submission_id)
+    comments, fetched = await prefetch(submission.comments[:ITEM_LIMIT])
+    return submission, comments, count_comments(submission.comments), reply_counts(comments, fetched)
+
+async def fetch_thread_json(submission_id: str) -> Optional[Tuple[SimpleNamespace, List[SimpleNamespace], int, Dict[str, int]]]:
+    """Fetch a submission and its top-level comments from Reddit's \
+            JSON API, in a single request.
+
+    :param submission_id: The ID of the submission.
+    :return: A tuple of the same form as that returned by \
+            `fetch_thread`, except that the submission and comments \
+            are represented by objects returned by `thing_from_json`, \
+            or None if the data could not be fetched (eg, because we \
+            are being rate limited).
+
+    """
+    global json_api_disabled_until
+    if time.monotonic() < json_api_disabled_until:
+        return None
+    import aiohttp
+    get_reddit()
+    params = {
+        # We need the top-level comments and their direct replies (so
+        # that we can count them). `limit` includes those replies.
+        'depth': 2,
+        'limit': ITEM_LIMIT * 8,
+        'raw_json': 1
+    }
+    try:
+        async with limit_reddit_requests(), http_session.get(
+            f'https://www.reddit.com/comments/{submission_id}.json',
+            params=params,
+            headers={'User-Agent': USER_AGENT},
+            timeout=aiohttp.ClientTimeout(total=JSON_API_TIMEOUT)
+        ) as resp:
+            resp.raise_for_status()
+            data = json_loads(await resp.read())
+        submission = thing_from_json(data[0]['data']['children'][0]['data'])
+        children = data[1]['data']['children']
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, LookupError) as e:
+        logging.warning(f'Could not get submission "{submission_id}" from JSON API '
+                        f'({e!r}); falling back to asyncpraw.')
+        # If we are being rate limited or Reddit is unavailable, stop
+        # using the JSON API for a while, so that every page doesn't
+        # wait for it to fail.
+        delay = json_api_backoff(e)
+        if delay is not None:
+            logging.warning(f'Not using JSON API for {delay:.0f} seconds.')
+            json_api_disabled_until = time.monotonic() + delay
+        return None
+    comments = [thing_from_json(c['data']) for c in children if c['kind'] == 't1']
+    num_replies = {}
+    for c in comments:
+        replies = c.replies['data']['children'] if c.replies else []
+        num_replies[c.id] = count_json_comments(replies)
+    return submission, comments[:ITEM_LIMIT], count_json_comments(children), num_replies
+
+def json_api_backoff(error: Exception) -> Optional[float]:
+    """Determine how long to stop using the JSON API after a failed \
+            request. We only stop using it if we are being rate \
+            limited (in which case the response headers tell us when \
+            to retry), if Reddit returns a server error or if the \
+            request times out or can't connect. Other errors (such as \
+            a 403 for a private subreddit, or unexpected data) are \
+            specific to the submission requested.
+
+    :param error: The exception raised by the failed request.
+    :return: The number of seconds to wait, or None if we should keep \
+            using the JSON API.
+
+    """
+    import aiohttp
+    if isinstance(error, aiohttp.ClientResponseError):
+        if error.status == 429:
+            headers = error.headers or {}
+            for name in ('Retry-After', 'x-ratelimit-reset'):
+                try:
+                    return max(float(headers[name]), 1.0)
+                except (KeyError, ValueError):
+                    continue
+            return JSON_API_BACKOFF
+        if error.status >= 500:
+            return JSON_API_BACKOFF
+        return None
+    if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+        return JSON_API_BACKOFF
+    return None
+
+def thing_from_json(data: dict) -> SimpleNamespace:
+    """Wrap the data for a submission or comment returned by Reddit's \
+            JSON API, so that it can be displayed in the same way as an \
+            asyncpraw object.
+
+    :param data: The "data" dict for the submission or comment.
+    :return: An object with the data's fields as attributes.
+
+    """
+    thing = SimpleNamespace(**data)
+    # Make author.name work as it would for an asyncpraw object
+    if thing.author is not None:
+        thing.author = SimpleNamespace(name=thing.author)
+    return thing
+
+def count_json_comments(children: List[dict]) -> int:
+    """Count the comments in a list of children returned by Reddit's \
+            JSON API, including those which were not returned but are \
+            listed in a "more" object.
+
+    :param children: The list of children.
+    :return: The number of comments.
+
+    """
+    count = 0
+    for c in children:
+        if c['kind'] == 't1':
+            count += 1
+        elif c['kind'] == 'more':
+            count += len(c['data']['children'])
+    return count
+
+async def display_comment(comment_id: str) -> AsyncIterator[str]:
     """Display the permalink for a comment. Displays the body of the \
             comment at the top of the page followed by a list of the \
             direct replies.
 
     :param comment_id: The ID of the comment we want to display.
-    :return: A list of strings, which will be displayed to the user as \
-            lines, in order.
+    :return: An iterator of strings, which will be displayed to the \
+            user as lines, in order.
 
     """
-    comment = reddit.comment(id=comment_id)
-    # Apparently need to do this refresh to get replies if the comment
-    # is not from a submission
-    comment.refresh()
+    comment = await get_reddit().comment(comment_id, fetch=False)
+    # Need to do this refresh to get replies if the comment is not from
+    # a submission. It also fetches the comment itself (including the
+    # title of the submission, as `link_title`).
+    await comment.refresh()
     author_name = author(comment)
     timestamp = date_time(comment)
-    body = parse_markdown(comment.body)
 
-    replies = comment.replies[:ITEM_LIMIT]
-    total_replies = len(comment.replies)
+    replies, fetched = await prefetch(comment.replies[:ITEM_LIMIT])
+    num_replies = reply_counts(replies, fetched)
+    total_replies = reply_count(comment)
     showing_replies = len(replies)
 
-    lines = [
-        f'# Comment by {author_name} on {timestamp}',
-        f'{comment.score} upvotes, {total_replies} direct replies (showing {showing_replies})',
-        f'=> {get_submission_url(comment)} View submission: {comment.submission.title}'
-    ]
+    yield f'# Comment by {author_name} on {timestamp}'
+    yield f'{comment.score} upvotes, {total_replies} direct replies (showing {showing_replies})'
+    yield f'=> {get_submission_url(comment)} View submission: {comment.link_title}'
     parent_url, is_submission = get_parent_url(comment)
     if not is_submission:
-        lines.append(f'=> {parent_url} View parent comment')
+        yield f'=> {parent_url} View parent comment'
     
-    lines.extend([
-        '',
-        *body,
-        '',
-        '',
-        '# Replies',
-        ''
-    ])
+    yield ''
+    for line in parse_markdown(comment.body):
+        yield line
+    yield ''
+    yield ''
+    yield '# Replies'
+    yield ''
 
     if not replies:
-        lines.append('There\'s nothing here!')
+        yield 'There\'s nothing here!'
     else:
-        for c in replies:
-            lines.extend(comment_summary(c, show_num_replies=True))
-            lines.append('')
+        for line in await render_comment_summaries(replies, num_replies):
+            yield line
 
-    return lines
 
-
-def comment_summary(comment: Comment, show_num_replies: bool = False) -> List[str]:
+def comment_summary(comment: Comment, num_replies: Optional[int] = None) -> Iterator[str]:
     """Display a summary of a comment (such as if we are viewing a \
             list of comments on a submission page).
 
-    :param comment: The praw.models.Comment object we want to display.
-    :param show_num_comments: Whether to display the number of direct \
-            replies the comment has received. Replies will only be \
+    :param comment: The asyncpraw.models.Comment object we want to \
+            display.
+    :param num_replies: The number of direct replies the comment has \
+            received, if it should be displayed. Replies will only be \
             available (without many expensive refresh() calls) if the \
             comment is a child of a submission.
-    :return: A list of strings, which will be displayed to the user as \
-            lines, in order.
+    :return: An iterator of strings, which will be displayed to the \
+            user as lines, in order.
 
     """
 
     author_name = author(comment)
     timestamp = date_time(comment)
-    body = parse_markdown(comment.body)
     url = parse_reddit_url(comment.permalink)
 
     metadata = f'{comment.score} upvotes'
-    if show_num_replies:
-        metadata += f', {len(comment.replies)} direct replies'
+    if num_replies is not None:
+        metadata += f', {num_replies} direct replies'
+
+    yield f'=> {url} Comment by {author_name} at {timestamp}'
+    yield metadata
+    yield ''
+    yield from parse_markdown(comment.body)
+
+async def render_comment_summaries(comments: List[Comment], num_replies: Dict[str, Optional[int]]) -> List[str]:
+    """Render summaries of the given comments (each followed by a blank \
+            line) in `render_pool`. All of the comments are rendered \
+            in a single job, as a job per comment costs more than \
+            rendering a comment whose markdown is already cached.
+
+    :param comments: The comments to display.
+    :param num_replies: A dict mapping each comment's ID to its number \
+            of direct replies, as for `comment_summary`.
+    :return: A list of strings, which will be displayed to the user \
+            as lines, in order.
 
-    return [
-        f'=> {url} Comment by {author_name} at {timestamp}',
-        metadata,
-        '',
-        *body
-    ]
+    """
+    def render() -> List[str]:
+        lines = []
+        for c in comments:
+            lines.extend(comment_summary(c, num_replies[c.id]))
+            lines.append('')
+        return lines
+    return await asyncio.get_running_loop().run_in_executor(render_pool, render)
 
 
 # Functions for displaying a user profile
 
-def display_redditor(name: str) -> List[str]:
+async def display_redditor(name: str) -> AsyncIterator[str]:
     """Display a Reddit user's submissions.
 
     :param name: The name of the user we want to display.
-    :return: A list of strings, which will be displayed to the user as \
-            lines, in order.
+    :return: An iterator of strings, which will be displayed to the \
+            user as lines, in order.
 
     """
-    redditor = reddit.redditor(name)
+    redditor = await get_reddit().redditor(name, fetch=True)
 
-    lines = [
-        f'# Redditor: {redditor.name}',
-    ]
+    yield f'# Redditor: {redditor.name}'
 
     try:
         if redditor.is_suspended:
-            lines.append('User is banned or suspended.')
-            return lines
+            yield 'User is banned or suspended.'
+            return
     except AttributeError:
         pass
 
     timestamp = date_time(redditor, date_only=True)
-    lines.extend([ 
-        f'Redditor since {timestamp} ({redditor.link_karma} link karma, {redditor.comment_karma} comment karma)',
-        ''
-    ])
-
-    lines.append('# Submissions')
-    lines.append('')
-    submissions = redditor.submissions.new(limit=ITEM_LIMIT)
+    yield f'Redditor since {timestamp} ({redditor.link_karma} link karma, {redditor.comment_karma} comment karma)'
+    yield ''
+
+    # Fetch the user's submissions and comments concurrently.
+    submissions, comments = await asyncio.gather(
+        collect(redditor.submissions.new(limit=ITEM_LIMIT)),
+        collect(redditor.comments.new(limit=ITEM_LIMIT))
+    )
+    submissions, _ = await prefetch(submissions)
+    comments, _ = await prefetch(comments)
+
+    yield '# Submissions'
+    yield ''
     if submissions:
         for s in submissions:
-            lines.extend(submission_summary(s))
-            lines.append('')
+            for line in submission_summary(s):
+                yield line
+            yield ''
     else:
-        lines.append('User has no submissions.')
-        lines.append('')
+        yield 'User has no submissions.'
+        yield ''
 
-    lines.append('# Comments')
-    lines.append('')
-    comments = redditor.comments.new(limit=ITEM_LIMIT)
+    yield '# Comments'
+    yield ''
     if comments:
-        for c in comments:
-            lines.extend(comment_summary(c))
-            lines.append('')
+        num_replies = dict.fromkeys((c.id for c in comments), None)
+        for line in await render_comment_summaries(comments, num_replies):
+            yield line
     else:
-        lines.append('User has no comments.')
-        lines.append('')
-
-    return lines
+        yield 'User has no comments.'
+        yield ''
  
 
 # Tying it all together
 
-def handle_r(tokens: List[str], path: str, query: str, check_only: bool = False) -> Union[bytes, bool]:
+def tokenize_path(path: str) -> List[str]:
+    """Split a (non-empty) request path into its fragments.
+
+    :param path: The request path.
+    :return: A list of strings, each representing a fragment of the \
+            path.
+
+    """
+    tokens = unquote(path).split('/')
+    if not tokens[0]:
+        # If the path we receive starts with a "/", the first item of this list
+        # will be an empty string, so we remove that.
+        tokens = tokens[1:]
+    if not tokens[-1]:
+        # Last token is empty string, meaning path ended with /
+        tokens.pop()
+    return tokens
+
+def r_dispatch_key(tokens: List[str]) -> Tuple[int, Optional[str]]:
+    """Get the key used to look up the handler for a "/r/" request in \
+            `R_DISPATCH`.
+
+    :param tokens: A list of strings, each representing a fragment of \
+            the request path (the leading 'r' is removed).
+    :return: A tuple containing the number of tokens (capped at 5) and \
+            the second token (or None if there is only one token).
+
+    """
+    return min(len(tokens), 5), (tokens[1] if len(tokens) > 1 else None)
+
+# Maps the "shape" of a "/r/" request path (see `r_dispatch_key`) to
+# the function that displays the relevant page and the index of the
+# token to pass to that function.
+R_DISPATCH = {
+    # Request is for a specific comment
+    (5, 'comments'): (display_comment, 4),
+    # Request is for all comments for a submission
+    (4, 'comments'): (display_submission, 2),
+    (3, 'comments'): (display_submission, 2),
+    # Request is to display subreddit
+    (1, None): (display_subreddit, 0)
+}
+
+async def handle_r(tokens: List[str], path: str, query: str) -> bytes:
     """Process a request where the path begins with "/r/".
     
     :param tokens: A list of strings, each representing a fragment of \
@@ -515,47 +1051,13 @@ def handle_r(tokens: List[str], path: str, query: str, check_only: bool = False)
     :param path: The full request path. Helpful for logging.
     :param query: The query string (ie, the bit of the URL following \
             a "?", if any).
-    :param check_only: If True, rather than returning data to send to \
-            the client, simply return True or False based on whether \
-            the path is supported. Use to check whether we need to \
-            convert Reddit URLs.
 
     :return: A bytes object containing the response to be sent to the \
-            client, or, if ``check_only`` is True, a bool representing \
-            whether the path is supported.
+            client.
     
     """
     
-    if (len(tokens) >= 5) and (tokens[1] == 'comments'):
-        # Request is for a specific comment
-        comment_id = tokens[4]
-        if check_only:
-            return True
-        logging.debug(f'Displaying comment with ID "{comment_id}".')
-        return ok(display_comment(comment_id))
-    elif (len(tokens) >= 3) and (tokens[1] == 'comments'):
-        # Request is for all comments for a submission
-        submission_id = tokens[2]
-        if check_only:
-            return True
-        logging.debug(f'Displaying submission with ID "{submission_id}".')
-        return ok(display_submission(submission_id))
-    elif len(tokens) == 1:
-        # Request is to display subreddit
-        name = tokens[0]
-        if check_only:
-            return True
-        logging.debug(f'Displaying subreddit with name "{name}".')
-        return ok(display_subreddit(name))
-    elif tokens:
-        # Got some unexpected form of URL. Log an error and return a bad request response
-        if check_only:
-            return False
-        logging.error(f'Got unexpected set of tokens: {tokens}.')
-        return bad_request(f'Request invalid or not supported: {path}')
-    else:
-        if check_only:
-            return True
+    if not tokens:
         if query:
             redirect_to = f'{BASE_URL}r/{query}'
             logging.debug(f'No path, but query found - redirecting to "{redirect_to}".')
@@ -563,8 +1065,16 @@ def handle_r(tokens: List[str], path: str, query: str, check_only: bool = False)
         else:
             logging.debug('No path or query found - prompting for subreddit name.')
             return get_input('Enter subreddit name:')
+    try:
+        display, index = R_DISPATCH[r_dispatch_key(tokens)]
+    except KeyError:
+        # Got some unexpected form of URL. Log an error and return a bad request response
+        logging.error(f'Got unexpected set of tokens: {tokens}.')
+        return bad_request(f'Request invalid or not supported: {path}')
+    logging.debug(f'Calling {display.__name__} with "{tokens[index]}".')
+    return await ok(display(tokens[index]))
 
-def handle_u(tokens: List[str], path: str, query: str, check_only: bool = False) -> Union[bytes, bool]:
+async def handle_u(tokens: List[str], path: str, query: str) -> bytes:
     """Process a request where the path begins with "/u/".
 
     :param tokens: A list of strings, each representing a fragment of \
@@ -572,32 +1082,21 @@ def handle_u(tokens: List[str], path: str, query: str, check_only: bool = False)
     :param path: The full request path. Helpful for logging.
     :param query: The query string (ie, the bit of the URL following \
             a "?", if any).
-    :param check_only: If True, rather than returning data to send to \
-            the client, simply return True or False based on whether \
-            the path is supported. Use to check whether we need to \
-            convert Reddit URLs.
 
     :return: A bytes object containing the response to be sent to the \
-            client, or, if ``check_only`` is True, a bool representing \
-            whether the path is supported.
+            client.
 
     """
 
     if tokens:
         if len(tokens) == 1:
-            if check_only:
-                return True
             name = tokens[0]
             logging.debug(f'Displaying user profile for {name}.')
-            return ok(display_redditor(name))
+            return await ok(display_redditor(name))
         else:
-            if check_only:
-                return False
             logging.warning(f'Got unsupported path "{path}".')
             return bad_request(f'Request invalid or not supported: {path}')
     else:
-        if check_only:
-            return True
         if query:
             redirect_to = f'{BASE_URL}u/{query}'
             logging.debug(f'No path, but query found - redirecting to "{redirect_to}".')
@@ -606,60 +1105,133 @@ def handle_u(tokens: List[str], path: str, query: str, check_only: bool = False)
             logging.debug('No path or query found - prompting for Redditor name.')
             return get_input('Enter Redditor name:')
 
-def handle_request(path: str, query: str = '', check_only: bool = False) -> Union[bytes, bool]:
+async def handle_request(path: str, query: str = '') -> bytes:
     """Handle a single request.
     
     :param path: The request path (ie, the bit of the URL following \
             the script endpoint and before a "?").
     :param query: The query string (ie, the bit of the URL following \
             a "?", if any).
-    :param check_only: If True, rather than returning data to send to \
-            the client, simply return True or False based on whether \
-            the path is supported. Use to check whether we need to \
-            convert Reddit URLs.
 
     :return: A bytes object containing the response to be sent to the \
-            client, or, if ``check_only`` is True, a bool representing \
-            whether the path is supported.
+            client.
 
     """
     path = path.strip().strip('/')
     if not path:
         # No additional path has been included.
         logging.debug('Empty path received.')
-        if check_only:
-            return True
-        if LANDING_PAGE:
-            with open(LANDING_PAGE) as f:
-                return ok(f.readlines(), join_on_newline=False)
-        else:
-            return ok(['Remini is working, but no landing page has been set.'])
-    if check_only:
-        logging.debug(f'Checking support for path "{path}".')
-    else:
-        logging.debug(f'Resolving path "{path}".')
-    tokens = unquote(path).split('/')
-    if not tokens[0]:
-        # If the path we receive starts with a "/", the first item of this list
-        # will be an empty string, so we remove that.
-        tokens = tokens[1:]
-    if not tokens[-1]:
-        # Last token is empty string, meaning path ended with /
-        tokens.pop()
+        return landing_page
+    logging.debug(f'Resolving path "{path}".')
+    tokens = tokenize_path(path)
     #logging.debug(f'Tokens: {tokens}')
+    key = blake2b(f'{path}?{query}'.encode(), digest_size=16).digest()
+    cache = page_caches[page_type(tokens)]
+    response = cache.get(key)
+    if response is not None:
+        logging.debug(f'Serving "{path}" from cache.')
+        return response
+    response = stale_page_cache.get(key)
+    if response is not None:
+        logging.debug(f'Serving stale "{path}" from cache and refreshing.')
+        if key not in pending_pages:
+            task = asyncio.create_task(refresh_page(key, cache, tokens, path, query))
+            refresh_tasks.add(task)
+            task.add_done_callback(refresh_tasks.discard)
+        return response
+    # Shield the render so that if this client goes away, other clients
+    # waiting for the same page are not affected.
+    return await asyncio.shield(render_page(key, cache, tokens, path, query))
+
+def page_type(tokens: List[str]) -> str:
+    """Determine the type of page requested, which determines how long \
+            the page is cached for.
+
+    :param tokens: A list of strings, each representing a fragment of \
+            the request path.
+    :return: A key of `page_caches`.
+
+    """
+    if tokens[0] == 'r':
+        if len(tokens) == 2:
+            return 'subreddit'
+        elif (len(tokens) >= 4) and (tokens[2] == 'comments'):
+            return 'comments'
+    return 'other'
+
+def cache_page(key: bytes, cache: TTLCache, response: bytes):
+    """Cache a response, if it is a successful one.
+
+    :param key: The key to cache the response under.
+    :param cache: The cache to store the response in.
+    :param response: The response to cache.
+
+    """
+    if response.startswith(b'20 '):
+        cache[key] = response
+        stale_page_cache[key] = response
+
+def render_page(key: bytes, cache: TTLCache, tokens: List[str], path: str, query: str) -> asyncio.Task:
+    """Get a task which fetches a fresh version of a page and caches \
+            it, starting one if the page is not already being rendered.
+
+    :param key: The key to cache the response under.
+    :param cache: The cache to store the response in.
+    :param tokens: A list of strings, each representing a fragment of \
+            the request path.
+    :param path: The full request path.
+    :param query: The query string.
+    :return: The task, the result of which is the response.
+
+    """
+    task = pending_pages.get(key)
+    if task is None:
+        async def render() -> bytes:
+            response = await dispatch_request(tokens, path, query)
+            cache_page(key, cache, response)
+            return response
+        task = asyncio.create_task(render())
+        pending_pages[key] = task
+        task.add_done_callback(lambda t: pending_pages.pop(key, None))
+    return task
+
+async def refresh_page(key: bytes, cache: TTLCache, tokens: List[str], path: str, query: str):
+    """Fetch a fresh version of a page in the background and cache it.
+
+    :param key: The key to cache the response under.
+    :param cache: The cache to store the response in.
+    :param tokens: A list of strings, each representing a fragment of \
+            the request path.
+    :param path: The full request path.
+    :param query: The query string.
+
+    """
+    try:
+        await render_page(key, cache, tokens, path, query)
+    except Exception as e:
+        logging.error(e, exc_info=True)
+
+async def dispatch_request(tokens: List[str], path: str, query: str) -> bytes:
+    """Pass a request to the appropriate handler, based on the first \
+            fragment of the path.
+
+    :param tokens: A list of strings, each representing a fragment of \
+            the request path.
+    :param path: The full request path.
+    :param query: The query string.
+    :return: A bytes object containing the response to be sent to the \
+            client.
+
+    """
     cmd = tokens[0]
     logging.info(f'Got command "{cmd}".')
     if cmd == 'r':
-        return handle_r(tokens[1:], path, query, check_only)
+        return await handle_r(tokens[1:], path, query)
     elif cmd == 'u':
-        return handle_u(tokens[1:], path, query, check_only)
+        return await handle_u(tokens[1:], path, query)
     else:
-        if check_only:
-            logging.debug(f'Path not supported: Unknown comment "{cmd}".')
-            return False
-        else:
-            logging.error(f'Unknown command "{cmd}".')
-            return bad_request(f'Couldn\'t parse path "{path}".')
+        logging.error(f'Unknown command "{cmd}".')
+        return bad_request(f'Couldn\'t parse path "{path}".')
 
 
 def from_cmd_line():
@@ -667,16 +1239,78 @@ def from_cmd_line():
     parsed = urlparse(full_path)
     path = parsed.path
     query = parsed.query
+
+    async def run() -> bytes:
+        try:
+            return await handle_request(path, query)
+        finally:
+            if reddit is not None:
+                await reddit.close()
+
     try:
-        print(handle_request(path, query).decode())
+        print(asyncio.run(run()).decode())
     except Exception as e:
         logging.error(e, exc_info=True)
         print(bad_request(GENERIC_ERR_MSG))
 
+async def read_scgi_headers(reader: asyncio.StreamReader) -> Dict[str, str]:
+    """Read the headers of an SCGI request. The headers are sent as a \
+            netstring, containing null-separated names and values.
+
+    :param reader: The stream to read the request from.
+    :return: A dict mapping header names to values.
+
+    """
+    length = await reader.readuntil(b':')
+    headers = await reader.readexactly(int(length[:-1]))
+    if (await reader.readexactly(1)) != b',':
+        raise ValueError('Malformed SCGI netstring.')
+    items = headers.decode('latin-1').split('\0')
+    return dict(zip(items[::2], items[1::2]))
+
+async def close_writer(writer: asyncio.StreamWriter):
+    """Close the connection to the Gemini server, ignoring any error \
+            caused by it having already been closed.
+
+    :param writer: The stream to close.
+
+    """
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
+
+async def handle_scgi(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Respond to a single SCGI request."""
+    try:
+        env = await read_scgi_headers(reader)
+    except (ValueError, ConnectionError, asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError) as e:
+        logging.error(f'Could not read SCGI request: {e}')
+        await close_writer(writer)
+        return
+    path = env.get('PATH_INFO', '')
+    logging.debug(f'PATH_INFO is "{path}".')
+    query = env.get('QUERY_STRING', '')
+    logging.debug(f'QUERY_STRING is "{query}".')
+    try:
+        response = await handle_request(path, query)
+    except Exception as e:
+        # Catch-all for any unhandled exception
+        logging.error(e, exc_info=True)
+        response = bad_request(GENERIC_ERR_MSG)
+    try:
+        writer.write(response)
+        await writer.drain()
+    except ConnectionError as e:
+        # The Gemini server closed the connection before we could send
+        # the whole response.
+        logging.warning(f'Could not send response to SCGI request: {e!r}')
+    finally:
+        await close_writer(writer)
+
 def from_scgi():
-    
-    import socket
-    import scgi.scgi_server
 
     try:
         SOCK = os.environ['REMINI_SCGI_SOCK']
@@ -684,25 +1318,18 @@ def from_scgi():
         raise RuntimeError('Must set "REMINI_SCGI_SOCK" environment variable.')
     if os.path.exists(SOCK):
         os.remove(SOCK)
-    
-    class ReminiHandler(scgi.scgi_server.SCGIHandler):
-
-        def produce(self, env, bodysize, input, output):
-            path = env.get('PATH_INFO')
-            logging.debug(f'PATH_INFO is "{path}".')
-            query = env.get('QUERY_STRING')
-            logging.debug(f'QUERY_STRING is "{query}".')
-            try:
-                output.write(handle_request(path, query))
-            except Exception as e:
-                # Catch-all for any unhandled exception
-                logging.error(e, exc_info=True)
-                output.write(bad_request(GENERIC_ERR_MSG))
-    
-    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    s.bind(SOCK)
-    server = scgi.scgi_server.SCGIServer(handler_class=ReminiHandler)
-    server.serve_on_socket(s)
+
+    async def serve():
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_landing_page)
+        get_reddit()
+        server = await asyncio.start_unix_server(handle_scgi, path=SOCK)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await reddit.close()
+
+    asyncio.run(serve())
 
 if __name__ == '__main__':
 
@@ -716,4 +1343,3 @@ if __name__ == '__main__':
         from_cmd_line()
     else:
         from_scgi()
-
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""Check that the compiled gemtext post-processing in gemparse.pyx \
+        gives the same output as the pure-Python implementation in \
+        remini.py. These tests don't need a running server, but are \
+        skipped if gemparse has not been built.
+
+"""
+
+import importlib
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope='module')
+def modules(tmp_path_factory):
+    """Import gemparse and remini. remini reads its config when it is \
+            imported, so it is given dummy values (unless some have been \
+            provided), which are removed again once the tests have run.
+
+    :return: A tuple containing the gemparse and remini modules.
+
+    """
+    with pytest.MonkeyPatch.context() as mp:
+        mp.syspath_prepend(REPO_DIR)
+        gemparse = pytest.importorskip('gemparse')
+        if 'REMINI_BASE_URL' not in os.environ:
+            mp.setenv('REMINI_BASE_URL', 'gemini://localhost/remini/')
+        if 'REMINI_PRAW_FILE' not in os.environ:
+            praw_file = tmp_path_factory.mktemp('remini') / 'praw.txt'
+            praw_file.write_text('client_id\nclient_secret\nremini test\n')
+            mp.setenv('REMINI_PRAW_FILE', str(praw_file))
+        remini = importlib.import_module('remini')
+        yield gemparse, remini
+    # Don't leave the module (configured with the dummy values) behind
+    # for other tests.
+    sys.modules.pop('remini', None)
+
+GEMTEXT_CASES = [
+    '',
+    'plain text',
+    '=>',
+    '=> ',
+    '=>x',
+    '=>\r',
+    '=> \rhttps://www.reddit.com/r/python',
+    '=>\thttps://www.reddit.com/r/python',
+    '=> https://www.reddit.com/r/python\tPython',
+    '=>  https://old.reddit.com/u/spez  two spaces',
+    '=> https://www.reddit.com/r/python/comments/abc123/title/ A submission',
+    '=> https://example.com/ Not Reddit\r',
+    '#',
+    '# Heading',
+    '## Subheading',
+    '### Third level',
+    '#\r',
+    '# Heading\r',
+    ' # Not a heading',
+    ' => Not a link',
+    '* => list item',
+    '=> https://www.reddit.com/r/python\n# Heading\n\n=>\n=> \nplain\r\n### x',
+]
+
+@pytest.mark.parametrize('gemtext', GEMTEXT_CASES)
+def test_fix_gemtext(modules, gemtext):
+    """Test that both implementations give the same output."""
+    gemparse, remini = modules
+    expected = remini.GEM_LINE_RE.sub(remini._fix_gem_line, gemtext)
+    assert gemparse.fix_gemtext(gemtext, remini.parse_reddit_url) == expected